@@ -2,13 +2,13 @@
 # Fully cleaned, no example buttons, no session_state errors.
 
 import os
-import io
 from pathlib import Path
 import re
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
 import pandas as pd
 import streamlit as st
-from PyPDF2 import PdfReader
-import google.generativeai as genai
 
 # ----- PAGE CONFIG -----
 st.set_page_config(
@@ -152,89 +152,189 @@ st.markdown(lovable_style, unsafe_allow_html=True)
 
 # ----- Load Interventions CSV -----
 INTERVENTIONS_CSV = os.environ.get("INTERVENTIONS_CSV", "data/irc_interventions.csv")
-genai.configure(api_key=os.environ.get("GOOGLE_API_KEY"))
 MODEL_NAME = "models/gemini-2.5-flash"
+MAX_PDF_CHARS = 200_000
+ROAD_ISSUE_TERMS = (
+    "pothole", "crack", "sign", "lighting", "barrier", "shoulder", "accident",
+    "drain", "flood", "curve", "school", "intersection",
+)
+# Fixed instructions for the model; each request only carries the issue text
+# and interventions.
+SUMMARY_INSTRUCTIONS = (
+    "You are a road safety engineer working with IRC guidelines. "
+    "Summarize the road safety issue and suggest the top interventions "
+    "from the list provided. When the issue is given as numbered report "
+    "excerpts, write one summary that covers all of them."
+)
+SUMMARY_WINDOWS = 8
+SUMMARY_WINDOW_CHARS = 500
+SUMMARY_COLUMNS = ["title", "description", "priority"]
+# Matched against lowercased text
+ISSUE_RE = re.compile(rf"\b(?:{'|'.join(ROAD_ISSUE_TERMS)})\b")
+# Case-insensitive twin for locating excerpts in the original text
+ISSUE_ANYCASE_RE = re.compile(ISSUE_RE.pattern, re.I)
 
 
+@st.cache_data(show_spinner=False)
 def load_interventions(csv_path):
     p = Path(csv_path)
     if p.exists():
         try:
             df = pd.read_csv(p)
-            if "keywords" not in df.columns:
-                df["keywords"] = ""
-            return df
+            for col in ("title", "description", "keywords"):
+                if col not in df.columns:
+                    df[col] = ""
         except:
-            return pd.DataFrame(columns=["title", "description", "keywords"])
+            df = pd.DataFrame(columns=["title", "description", "keywords"])
     else:
-        return pd.DataFrame([
+        df = pd.DataFrame([
             {"title": "Pothole Repair", "description": "Patch and re-lay carriageway.", "keywords": "pothole"},
             {"title": "Improved Lighting", "description": "Install LED lighting.", "keywords": "lighting"},
             {"title": "Drainage Clearing", "description": "Clear blocked drains.", "keywords": "drain,flood"},
         ])
+    return df
+
+
+def normalize_keywords(k):
+    if isinstance(k, str):
+        return [x.strip().lower() for x in k.split(",") if x.strip()]
+    return []
+
+
+@st.cache_data(show_spinner=False)
+def build_keyword_index(csv_path):
+    # Maps an issue term to the row positions it matches: exact keyword
+    # entries plus known issue terms found in the title or description.
+    df = load_interventions(csv_path)
+    index = defaultdict(set)
+    for pos, row in enumerate(df.itertuples(index=False)):
+        for kw in normalize_keywords(row.keywords):
+            index[kw].add(pos)
+        text = f"{row.title}\n{row.description}".lower()
+        for term in ROAD_ISSUE_TERMS:
+            if term in text:
+                index[term].add(pos)
+    return dict(index)
+
 
+@st.cache_data(show_spinner=False)
+def extract_text_from_pdf(file_bytes, max_chars=None):
+    # Returns (text, truncated); truncated is True when max_chars cut the report short
+    import pymupdf  # imported on first upload
 
-def extract_text_from_pdf(pdf_path):
     try:
-        reader = PdfReader(pdf_path)
-        text = ""
-        for page in reader.pages:
-            t = page.extract_text()
-            if t:
-                text += t + "\n"
-        return text.strip()
+        pages = []
+        size = 0
+        stopped_early = False
+        # Pages are read sequentially: PyMuPDF is not thread-safe and holds the GIL
+        with pymupdf.open(stream=file_bytes, filetype="pdf") as doc:
+            for page in doc:
+                t = page.get_text()
+                pages.append(t)
+                size += len(t)
+                # Stop opening pages once the budget is spent
+                if max_chars is not None and size >= max_chars:
+                    stopped_early = page.number < doc.page_count - 1
+                    break
+        text = "\n".join(pages)
+        truncated = stopped_early or (max_chars is not None and len(text) > max_chars)
+        return text[:max_chars].strip(), truncated
     except:
-        return ""
+        return "", False
 
 
 def extract_road_issues(text):
     if not text:
-        return []
-    pattern = r"(?i)\b(pothole|crack|sign|lighting|barrier|shoulder|accident|drain|flood|curve|school|intersection)\b"
-    found = re.findall(pattern, text)
-    return list({x.lower() for x in found})
+        return set()
+    return set(ISSUE_RE.findall(text.lower()))
 
 
-def normalize_keywords(k):
-    if isinstance(k, str):
-        return [x.strip().lower() for x in k.split(",") if x.strip()]
-    return []
+def find_matching_interventions(issues, df, index):
+    hits = set().union(*(index[iss] for iss in issues if iss in index))
+    if not hits:
+        return pd.DataFrame()
+    return df.iloc[sorted(hits)]
 
 
-def find_matching_interventions(issues, df):
-    matches = []
-    for _, row in df.iterrows():
-        kws = normalize_keywords(row.get("keywords", ""))
-        desc = row.get("description", "").lower()
-        title = row.get("title", "").lower()
+@st.cache_resource(ttl=3600)
+def summary_cache():
+    # Finished summaries by (issue excerpt, interventions), shared across sessions
+    return {}
 
-        for iss in issues:
-            if iss in kws or iss in desc or iss in title:
-                matches.append(row)
-                break
 
-    if matches:
-        return pd.DataFrame(matches)
-    return pd.DataFrame()
+def issue_windows(text, width=SUMMARY_WINDOW_CHARS):
+    # Non-overlapping excerpts around each issue mention, in document order
+    end = 0
+    for m in ISSUE_ANYCASE_RE.finditer(text):
+        if m.start() < end:
+            continue
+        start = max(m.start() - width // 2, end)
+        end = start + width
+        yield " ".join(text[start:end].split())
 
 
 def generate_ai_summary(issue_text, result_df):
-    short = issue_text[:600]
-    df_small = result_df.head(5)
-    prompt = f"""
-Summarize the road safety issue and suggest top interventions.
-Issue: {short}
-Interventions: {df_small.to_string(index=False)}
-"""
+    # All issue excerpts go out in a single request; scanning stops once enough are found
+    windows = list(islice(issue_windows(issue_text), SUMMARY_WINDOWS))
+    if windows:
+        short = "\n".join(f"{i}. {w}" for i, w in enumerate(windows, 1))
+    else:
+        short = issue_text[:600]
+    # Compact JSON of just the fields the model needs keeps input tokens down
+    cols = [c for c in SUMMARY_COLUMNS if c in result_df.columns]
+    interventions = result_df.head(5)[cols].to_json(orient="records", force_ascii=False)
+
+    cache = summary_cache()
+    key = (short, interventions)
+    if key in cache:
+        return iter([cache[key]])
+
     try:
-        model = genai.GenerativeModel(MODEL_NAME)
-        res = model.generate_content(prompt)
-        return res.text or "No summary generated."
-    except:
-        return "AI Summary unavailable."
+        model = get_gemini_model()
+    except Exception:
+        return iter(["AI Summary unavailable."])
+
+    # The request is sent now, on a worker thread, so the first chunk is already
+    # on its way while the caller renders the interventions
+    prompt = f"Issue: {short}\nInterventions: {interventions}"
+    future = summary_executor().submit(model.generate_content, prompt, stream=True)
+    return stream_ai_summary(future, cache, key)
+
+
+def stream_ai_summary(future, cache, key):
+    parts = []
+    try:
+        for chunk in future.result():
+            if chunk.text:
+                parts.append(chunk.text)
+                yield chunk.text
+    except Exception:
+        # Don't contradict text the user has already seen
+        yield " (summary interrupted)" if parts else "AI Summary unavailable."
+        return
+
+    if parts:
+        cache[key] = "".join(parts)
+    else:
+        yield "No summary generated."
+
+
+@st.cache_resource
+def get_gemini_model():
+    # The Gemini SDK is only imported and configured once the first summary is requested
+    import google.generativeai as genai
+
+    genai.configure(api_key=os.environ.get("GOOGLE_API_KEY"))
+    return genai.GenerativeModel(MODEL_NAME, system_instruction=SUMMARY_INSTRUCTIONS)
+
+
+@st.cache_resource
+def summary_executor():
+    return ThreadPoolExecutor(max_workers=4)
 
 
 interventions_df = load_interventions(INTERVENTIONS_CSV)
+keyword_index = build_keyword_index(INTERVENTIONS_CSV)
 
 # ----- HERO -----
 st.markdown("""
@@ -267,18 +367,24 @@ st.markdown("</div>", unsafe_allow_html=True)
 # Manual
 user_input = None
 uploaded_pdf = None
+analyze_manual = False
+analyze_pdf = False
 
+# Inputs live in forms so editing them does not rerun the analysis
 if mode == "📝 Describe Manually":
     st.markdown("<div class='card'>", unsafe_allow_html=True)
     st.markdown("<h3>Describe the road issue</h3>", unsafe_allow_html=True)
-    user_input = st.text_area("", placeholder="Example: High-speed curve with insufficient signage", height=180)
-    analyze_manual = st.button("Analyze Issue")
+    with st.form("manual_form"):
+        user_input = st.text_area("", placeholder="Example: High-speed curve with insufficient signage", height=180)
+        analyze_manual = st.form_submit_button("Analyze Issue")
     st.markdown("</div>", unsafe_allow_html=True)
 
 else:
     st.markdown("<div class='card'>", unsafe_allow_html=True)
     st.markdown("<h3>Upload Road Report (PDF)</h3>", unsafe_allow_html=True)
-    uploaded_pdf = st.file_uploader("", type=["pdf"])
+    with st.form("pdf_form"):
+        uploaded_pdf = st.file_uploader("", type=["pdf"])
+        analyze_pdf = st.form_submit_button("Analyze Report")
     st.markdown("</div>", unsafe_allow_html=True)
 
 # Tips Card
@@ -322,16 +428,40 @@ def render_interventions(df):
         """
         st.markdown(html, unsafe_allow_html=True)
 
-# --- MANUAL MODE ---
+# Run the pipeline once per submit; other reruns redraw the stored result
 if mode == "📝 Describe Manually" and user_input and analyze_manual:
     with st.spinner("Analyzing issue..."):
         issues = extract_road_issues(user_input)
-        matches = find_matching_interventions(issues, interventions_df)
+        matches = find_matching_interventions(issues, interventions_df, keyword_index)
+    st.session_state["analysis"] = {"mode": mode, "text": user_input, "issues": issues, "matches": matches}
+
+elif mode == "📄 Upload PDF Report" and uploaded_pdf and analyze_pdf:
+    with st.spinner("Extracting and analyzing PDF..."):
+        pdf_text, truncated = extract_text_from_pdf(uploaded_pdf.getvalue(), MAX_PDF_CHARS)
+        issues = extract_road_issues(pdf_text)
+        matches = find_matching_interventions(issues, interventions_df, keyword_index)
+    st.session_state["analysis"] = {
+        "mode": mode, "text": pdf_text, "issues": issues, "matches": matches, "truncated": truncated,
+    }
+
+elif analyze_manual or analyze_pdf:
+    # Submitted with nothing to analyze: don't redraw the previous result
+    st.session_state.pop("analysis", None)
+
+analysis = st.session_state.get("analysis")
+if analysis and analysis["mode"] != mode:
+    analysis = None
+
+# --- MANUAL MODE ---
+if analysis and mode == "📝 Describe Manually":
+    issues = analysis["issues"]
+    matches = analysis["matches"]
+    summary = generate_ai_summary(analysis["text"], matches)
 
     # Results
     st.markdown("<div class='card'>", unsafe_allow_html=True)
     st.markdown("<h3>Analysis Results</h3>", unsafe_allow_html=True)
-    st.markdown(f"<div class='muted'>Detected issues: {', '.join(issues)}</div>", unsafe_allow_html=True)
+    st.markdown(f"<div class='muted'>Detected issues: {', '.join(sorted(issues))}</div>", unsafe_allow_html=True)
     st.markdown("</div>", unsafe_allow_html=True)
 
     st.markdown("<div class='card'>", unsafe_allow_html=True)
@@ -344,19 +474,20 @@ if mode == "📝 Describe Manually" and user_input and analyze_manual:
 
     st.markdown("<div class='card'>", unsafe_allow_html=True)
     st.markdown("<h3>AI Summary</h3>", unsafe_allow_html=True)
-    st.write(generate_ai_summary(user_input, matches))
+    st.write_stream(summary)
     st.markdown("</div>", unsafe_allow_html=True)
 
 # --- PDF MODE ---
-elif mode == "📄 Upload PDF Report" and uploaded_pdf:
-    with st.spinner("Extracting and analyzing PDF..."):
-        pdf_text = extract_text_from_pdf(io.BytesIO(uploaded_pdf.read()))
-        issues = extract_road_issues(pdf_text)
-        matches = find_matching_interventions(issues, interventions_df)
+elif analysis and mode == "📄 Upload PDF Report":
+    pdf_text = analysis["text"]
+    matches = analysis["matches"]
+    summary = generate_ai_summary(pdf_text, matches)
 
     st.markdown("<div class='card'>", unsafe_allow_html=True)
     st.markdown("<h3>Extracted text (preview)</h3>", unsafe_allow_html=True)
     st.text_area("", pdf_text[:2000], height=260)
+    if analysis.get("truncated"):
+        st.info(f"Only the first {MAX_PDF_CHARS:,} characters of this report were analyzed.")
     st.markdown("</div>", unsafe_allow_html=True)
 
     st.markdown("<div class='card'>", unsafe_allow_html=True)
@@ -369,7 +500,7 @@ elif mode == "📄 Upload PDF Report" and uploaded_pdf:
 
     st.markdown("<div class='card'>", unsafe_allow_html=True)
     st.markdown("<h3>AI Summary</h3>", unsafe_allow_html=True)
-    st.write(generate_ai_summary(pdf_text[:2000], matches))
+    st.write_stream(summary)
     st.markdown("</div>", unsafe_allow_html=True)
 
 # ---- DEFAULT OVERVIEW ----
@@ -5,11 +5,8 @@ nlp = spacy.load("en_core_web_sm")
 
 def extract_text_from_pdf(pdf_path):
     """Extracts raw text from a PDF file."""
-    text = ""
     with fitz.open(pdf_path) as pdf:
-        for page in pdf:
-            text += page.get_text()
-    return text
+        return "".join(page.get_text() for page in pdf)
 
 def extract_road_issues(text):
     """Extracts potential road safety issues using simple NLP logic."""